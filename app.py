@@ -1,22 +1,39 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+import uuid
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, abort
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import selectinload
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 from dotenv import load_dotenv
+from werkzeug.middleware.proxy_fix import ProxyFix
+import storage
+import metrics
+from security import hash_password, verify_password, login_limiter, UNUSABLE_PASSWORD
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
+# Number of reverse proxies in front of the app (1 on Render). Their
+# X-Forwarded-* headers are trusted so request.remote_addr is the client's
+# address, which the login rate limiter keys on.
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', '0'))
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///assignments.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///assignments.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Leave headroom for the other form fields on top of the file itself
+app.config['MAX_CONTENT_LENGTH'] = storage.MAX_UPLOAD_SIZE + 64 * 1024
 
 db = SQLAlchemy(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
+metrics.init_app(app)
 
 # Models
 class User(UserMixin, db.Model):
@@ -42,15 +59,47 @@ class Assignment(db.Model):
     status = db.Column(db.String(20), default='pending')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Set once per form render / bot conversation so repeated submits are absorbed
+    idempotency_key = db.Column(db.String(64), nullable=True)
+    attachments = db.relationship('Attachment', backref='assignment', lazy=True)
+    __table_args__ = (db.UniqueConstraint('user_id', 'idempotency_key'),)
+
+class Attachment(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False, index=True)
+    size = db.Column(db.Integer, nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    content_type = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    assignment_id = db.Column(db.Integer, db.ForeignKey('assignment.id'), nullable=False)
+
+class SentReminder(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    assignment_id = db.Column(db.Integer, db.ForeignKey('assignment.id'), nullable=False)
+    offset_hours = db.Column(db.Integer, nullable=False)
+    sent_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (db.UniqueConstraint('assignment_id', 'offset_hours'),)
 
 # Create tables and add admin user if not exists
 with app.app_context():
     db.create_all()
+    # create_all does not add columns to existing tables
+    if 'idempotency_key' not in [c['name'] for c in inspect(db.engine).get_columns('assignment')]:
+        db.session.execute(text('ALTER TABLE assignment ADD COLUMN idempotency_key VARCHAR(64)'))
+        db.session.execute(text(
+            'CREATE UNIQUE INDEX uq_assignment_user_idempotency ON assignment (user_id, idempotency_key)'
+        ))
+        db.session.commit()
     # Create admin user if not exists
     if not User.query.filter_by(username='admin').first():
-        admin = User(username='admin', password='admin123', is_admin=True)
+        admin = User(username='admin', password=hash_password('admin123'), is_admin=True)
         db.session.add(admin)
         db.session.commit()
+    # Bot users used to get a shared plaintext placeholder password
+    User.query.filter(
+        User.telegram_id.isnot(None), User.password == 'telegram_user'
+    ).update({'password': UNUSABLE_PASSWORD}, synchronize_session=False)
+    db.session.commit()
 
 # Mock data for the form
 FACULTIES = ["Факультет 1", "Факультет 2", "Факультет 3"]
@@ -62,6 +111,11 @@ WORK_TYPES = ["Промежуточная работа", "Практическа
 def load_user(user_id):
     return User.query.get(int(user_id))
 
+# base.html shows the current year in the footer
+@app.context_processor
+def inject_now():
+    return {'now': datetime.utcnow()}
+
 # Routes
 @app.route('/')
 def index():
@@ -72,9 +126,20 @@ def login():
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
+        
+        # Checked before the expensive hash so bursts are rejected cheaply
+        if not (login_limiter.allow(f'ip:{request.remote_addr}') and login_limiter.allow(f'user:{username}')):
+            flash('Слишком много попыток входа. Попробуйте позже.', 'danger')
+            return render_template('login.html'), 429
+        
         user = User.query.filter_by(username=username).first()
+        # Unknown usernames are checked against a dummy hash, so both cost the same
+        matches, needs_rehash = verify_password(user.password if user else None, password)
         
-        if user and user.password == password:  # In production, use proper password hashing
+        if matches:
+            if needs_rehash:
+                user.password = hash_password(password)
+                db.session.commit()
             login_user(user)
             next_page = request.args.get('next')
             return redirect(next_page or url_for('dashboard'))
@@ -88,11 +153,15 @@ def register():
         username = request.form.get('username')
         password = request.form.get('password')
         
+        if not login_limiter.allow(f'register:{request.remote_addr}'):
+            flash('Слишком много попыток. Попробуйте позже.', 'danger')
+            return render_template('register.html'), 429
+        
         if User.query.filter_by(username=username).first():
             flash('Пользователь с таким именем уже существует', 'danger')
             return redirect(url_for('register'))
         
-        user = User(username=username, password=password)  # In production, hash the password
+        user = User(username=username, password=hash_password(password))
         db.session.add(user)
         db.session.commit()
         
@@ -111,7 +180,10 @@ def logout():
 @login_required
 def dashboard():
     if current_user.is_admin:
-        assignments = Assignment.query.order_by(Assignment.status, Assignment.deadline).all()
+        # Attachments are listed for admins; load them in one query, not one per row
+        assignments = Assignment.query.options(selectinload(Assignment.attachments)).order_by(
+            Assignment.status, Assignment.deadline
+        ).all()
     else:
         assignments = Assignment.query.filter_by(user_id=current_user.id).order_by(Assignment.status, Assignment.deadline).all()
     
@@ -128,6 +200,22 @@ def new_assignment():
         deadline = request.form.get('deadline')
         task_source = request.form.get('task_source')
         work_type = request.form.get('work_type')
+        idempotency_key = request.form.get('idempotency_key') or None
+        
+        if idempotency_key and Assignment.query.filter_by(
+            user_id=current_user.id, idempotency_key=idempotency_key
+        ).first():
+            flash('Это задание уже создано', 'info')
+            return redirect(url_for('dashboard'))
+        
+        upload = request.files.get('attachment')
+        stored = None
+        if task_source == 'upload' and upload and upload.filename:
+            try:
+                stored = storage.save_stream(upload.stream)
+            except storage.FileTooLarge:
+                flash('Файл слишком большой', 'danger')
+                return redirect(url_for('new_assignment'))
         
         assignment = Assignment(
             course=course,
@@ -137,11 +225,27 @@ def new_assignment():
             deadline=deadline,
             task_source=task_source,
             work_type=work_type,
-            user_id=current_user.id
+            user_id=current_user.id,
+            idempotency_key=idempotency_key
         )
         
         db.session.add(assignment)
-        db.session.commit()
+        if stored:
+            digest, size = stored
+            db.session.add(Attachment(
+                assignment=assignment,
+                sha256=digest,
+                size=size,
+                filename=upload.filename,
+                content_type=upload.mimetype
+            ))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # A concurrent submit with the same key got there first
+            db.session.rollback()
+            flash('Это задание уже создано', 'info')
+            return redirect(url_for('dashboard'))
         
         flash('Задание успешно создано!', 'success')
         return redirect(url_for('dashboard'))
@@ -149,7 +253,26 @@ def new_assignment():
     return render_template('new_assignment.html', 
                          courses=COURSES, 
                          faculties=FACULTIES,
-                         work_types=WORK_TYPES)
+                         work_types=WORK_TYPES,
+                         idempotency_key=uuid.uuid4().hex,
+                         max_upload_mb=storage.MAX_UPLOAD_SIZE // (1024 * 1024))
+
+@app.route('/attachment/<int:attachment_id>')
+@login_required
+def download_attachment(attachment_id):
+    if not current_user.is_admin:
+        abort(403)
+    attachment = Attachment.query.get_or_404(attachment_id)
+    path = storage.path_for(attachment.sha256)
+    if not os.path.exists(path):
+        abort(404)
+    return send_file(path, mimetype=attachment.content_type, as_attachment=True,
+                     download_name=attachment.filename)
+
+@app.errorhandler(413)
+def upload_too_large(error):
+    flash('Файл слишком большой', 'danger')
+    return redirect(url_for('new_assignment'))
 
 @app.route('/api/subjects')
 @login_required
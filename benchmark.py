@@ -0,0 +1,325 @@
+"""Benchmark the web and bot hot paths against a seeded SQLite database.
+
+Usage:
+    python benchmark.py --users 1000 --assignments 10000
+    python benchmark.py --assignments 1000000 --json bench.json
+    python benchmark.py --baseline bench.json --tolerance 0.25
+
+The database and uploads live in a temporary directory unless --db is given,
+so the real assignments.db is never touched.
+"""
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BATCH_SIZE = 10000
+PASSWORD = 'bench-password'
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def summarize(name, latencies, errors, elapsed, peak_bytes):
+    return {
+        'name': name,
+        'count': len(latencies),
+        'errors': errors,
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p90_ms': percentile(latencies, 90) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': max(latencies) * 1000 if latencies else 0.0,
+        'peak_kb': peak_bytes / 1024,
+    }
+
+def seed(db, User, Assignment, users, assignments):
+    """Bulk insert users and assignments with a realistic mix of values."""
+    from app import FACULTIES, COURSES, WORK_TYPES
+    from security import hash_password
+
+    rng = random.Random(42)
+    today = datetime.now()
+    # One hash shared by every user: hashing each password would dominate seeding
+    password_hash = hash_password(PASSWORD)
+    user_rows = [
+        {'username': f'student{i}', 'password': password_hash, 'is_admin': False,
+         'telegram_id': str(100000 + i) if i % 2 else None}
+        for i in range(users)
+    ]
+    for start in range(0, len(user_rows), BATCH_SIZE):
+        db.session.execute(User.__table__.insert(), user_rows[start:start + BATCH_SIZE])
+    User.query.filter_by(username='admin').update({'password': password_hash})
+    db.session.commit()
+    user_ids = [row.id for row in db.session.query(User.id).filter(User.is_admin.is_(False))]
+
+    statuses = ['pending'] * 5 + ['in_progress'] * 3 + ['completed'] * 2
+    batch = []
+    for i in range(assignments):
+        course = rng.choice(COURSES)
+        course_num = int(course.split()[0])
+        deadline = today + timedelta(days=rng.randint(-30, 90))
+        batch.append({
+            'course': course,
+            'semester': f"{2*course_num - rng.randint(0, 1)} семестр",
+            'faculty': rng.choice(FACULTIES),
+            'subjects': ", ".join(rng.sample([f"Предмет {n}" for n in range(1, 10)], rng.randint(1, 3))),
+            # Web rows use the date input format, bot rows ДД.ММ.ГГГГ
+            'deadline': deadline.strftime('%Y-%m-%d' if i % 2 else '%d.%m.%Y'),
+            'task_source': rng.choice(['upload', 'moodle']),
+            'work_type': rng.choice(WORK_TYPES),
+            'status': rng.choice(statuses),
+            'created_at': today - timedelta(days=rng.randint(0, 365)),
+            'user_id': rng.choice(user_ids),
+        })
+        if len(batch) == BATCH_SIZE:
+            db.session.execute(Assignment.__table__.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(Assignment.__table__.insert(), batch)
+    db.session.commit()
+
+def measure(name, make_request, iterations, expected=(200, 302)):
+    """Time make_request() repeatedly, then trace the allocations of one more call."""
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        response = make_request()
+        latencies.append(time.perf_counter() - t0)
+        if response.status_code not in expected:
+            errors += 1
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    make_request()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return summarize(name, latencies, errors, elapsed, peak)
+
+def login(client, username):
+    return client.post('/login', data={'username': username, 'password': PASSWORD})
+
+def bench_web(app, iterations, admin_iterations):
+    from app import FACULTIES, COURSES, WORK_TYPES
+
+    results = []
+    anonymous = app.test_client()
+    student = app.test_client()
+    admin = app.test_client()
+    login(student, 'student0')
+    login(admin, 'admin')
+
+    deadline = (datetime.now() + timedelta(days=14)).strftime('%Y-%m-%d')
+    def create_assignment(idempotency_key=None):
+        return student.post('/assignment/new', data={
+            'idempotency_key': idempotency_key or uuid.uuid4().hex,
+            'course': COURSES[0],
+            'semester': '1 семестр',
+            'faculty': FACULTIES[0],
+            'subjects': 'Предмет 1.1',
+            'deadline': deadline,
+            'task_source': 'upload',
+            'work_type': WORK_TYPES[0],
+            'attachment': (io.BytesIO(b'%PDF-1.4 benchmark task\n' * 64), 'task.pdf'),
+        }, content_type='multipart/form-data')
+
+    results.append(measure('GET /login', lambda: anonymous.get('/login'), iterations))
+    results.append(measure('POST /login', lambda: login(app.test_client(), 'student0'), iterations, (302,)))
+    results.append(measure('GET /api/subjects', lambda: student.get('/api/subjects?faculty=' + FACULTIES[0]), iterations))
+    results.append(measure('GET /assignment/new', lambda: student.get('/assignment/new'), iterations))
+    results.append(measure('POST /assignment/new', create_assignment, iterations, (302,)))
+    duplicate_key = uuid.uuid4().hex
+    results.append(measure(
+        'POST /assignment/new (dup)', lambda: create_assignment(duplicate_key), iterations, (302,)
+    ))
+    results.append(measure('GET /dashboard (student)', lambda: student.get('/dashboard'), iterations))
+    results.append(measure('GET /dashboard (admin)', lambda: admin.get('/dashboard'), admin_iterations))
+    return results
+
+async def bench_bot(app, conversations):
+    from app import FACULTIES, COURSES, WORK_TYPES, Assignment
+    from telegram_stub import StubRequest, UpdateFactory, build_stub_application
+
+    request = StubRequest()
+    application = await build_stub_application(request)
+    # PTB swallows handler exceptions, so collect them to report as errors
+    bot_errors = []
+
+    async def count_error(update, context):
+        bot_errors.append(context.error)
+    application.add_error_handler(count_error)
+
+    with app.app_context():
+        assignments_before = Assignment.query.count()
+    factory = UpdateFactory(application.bot)
+    deadline = (datetime.now() + timedelta(days=14)).strftime('%d.%m.%Y')
+
+    steps = [
+        ('start', lambda uid: factory.command(uid, 'start')),
+        ('course', lambda uid: factory.callback(uid, COURSES[0])),
+        ('semester', lambda uid: factory.callback(uid, '1 семестр')),
+        ('faculty', lambda uid: factory.callback(uid, FACULTIES[0])),
+        ('subject', lambda uid: factory.callback(uid, 'Предмет 1')),
+        ('subjects done', lambda uid: factory.callback(uid, 'done')),
+        ('deadline', lambda uid: factory.text(uid, deadline)),
+        ('task source', lambda uid: factory.callback(uid, 'upload')),
+        ('attachment', lambda uid: factory.document(uid)),
+        ('work type', lambda uid: factory.callback(uid, WORK_TYPES[0])),
+    ]
+    step_latencies = {name: [] for name, _ in steps}
+    step_errors = {name: 0 for name, _ in steps}
+    totals = []
+    failed_conversations = 0
+    started = time.perf_counter()
+    for i in range(conversations):
+        user_id = 900000 + i
+        conversation_errors = len(bot_errors)
+        t_conv = time.perf_counter()
+        for name, make_update in steps:
+            update = make_update(user_id)
+            errors_before = len(bot_errors)
+            t0 = time.perf_counter()
+            await application.process_update(update)
+            step_latencies[name].append(time.perf_counter() - t0)
+            step_errors[name] += len(bot_errors) - errors_before
+        totals.append(time.perf_counter() - t_conv)
+        if len(bot_errors) > conversation_errors:
+            failed_conversations += 1
+    elapsed = time.perf_counter() - started
+
+    # One traced conversation for the allocation peak
+    tracemalloc.start()
+    for name, make_update in steps:
+        await application.process_update(make_update(800000))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    await application.shutdown()
+
+    # Every conversation, including the traced one, must have saved its order
+    with app.app_context():
+        created = Assignment.query.count() - assignments_before
+
+    results = [
+        summarize(f'bot: {name}', latencies, step_errors[name], sum(latencies), 0)
+        for name, latencies in step_latencies.items()
+    ]
+    results.append(summarize('bot: full conversation', totals, failed_conversations, elapsed, peak))
+    results.append({'name': 'bot: assignments created', 'expected': conversations + 1, 'created': created})
+    results.append({'name': 'bot: Bot API calls', 'calls': dict(request.calls)})
+    if bot_errors:
+        print(f"Bot handlers raised {len(bot_errors)} errors, first: {bot_errors[0]!r}", file=sys.stderr)
+    return results
+
+def failures(results):
+    """Return descriptions of scenarios that had errors or did not finish their work."""
+    problems = []
+    for r in results:
+        if r.get('errors'):
+            problems.append(f"{r['name']}: {r['errors']} errors")
+        if 'expected' in r and r['created'] != r['expected']:
+            problems.append(f"{r['name']}: {r['created']} of {r['expected']}")
+    return problems
+
+def print_report(results):
+    header = f"{'scenario':<28}{'count':>7}{'err':>5}{'req/s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}{'peak KB':>10}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        if 'calls' in r:
+            print(f"{r['name']:<28}{r['calls']}")
+            continue
+        if 'expected' in r:
+            print(f"{r['name']:<28}{r['created']} of {r['expected']}")
+            continue
+        print(f"{r['name']:<28}{r['count']:>7}{r['errors']:>5}{r['throughput']:>10.1f}"
+              f"{r['p50_ms']:>10.2f}{r['p90_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['max_ms']:>10.2f}{r['peak_kb']:>10.1f}")
+
+def compare(results, baseline_path, tolerance):
+    """Return the scenarios whose p90 regressed by more than tolerance against a saved run."""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {r['name']: r for r in json.load(f)['results'] if 'p90_ms' in r}
+    regressions = []
+    for r in results:
+        old = baseline.get(r['name'])
+        if old and 'p90_ms' in r and r['p90_ms'] > old['p90_ms'] * (1 + tolerance):
+            regressions.append((r['name'], old['p90_ms'], r['p90_ms']))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--assignments', type=int, default=10000)
+    parser.add_argument('--iterations', type=int, default=200, help='requests per web scenario')
+    parser.add_argument('--admin-iterations', type=int, default=10, help='requests for the admin dashboard')
+    parser.add_argument('--conversations', type=int, default=100, help='full bot conversations')
+    parser.add_argument('--hash-iterations', type=int, help='PBKDF2 iterations (default: PASSWORD_HASH_ITERATIONS)')
+    parser.add_argument('--db', help='SQLite file to use (default: a temporary file)')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='results file from a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p90 slowdown vs baseline')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='zakaz-bench-')
+    db_path = os.path.abspath(args.db or os.path.join(workdir, 'bench.db'))
+    # app reads these at import time, so they must be set before importing it
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    os.environ['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+    # Every login comes from the same test client address
+    os.environ['LOGIN_RATE_PER_MINUTE'] = '0'
+    if args.hash_iterations:
+        os.environ['PASSWORD_HASH_ITERATIONS'] = str(args.hash_iterations)
+
+    import logging
+    from app import app, db, User, Assignment
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with app.app_context():
+        if not User.query.filter(User.username != 'admin').first():
+            print(f"Seeding {args.users} users and {args.assignments} assignments into {db_path}...")
+            t0 = time.perf_counter()
+            seed(db, User, Assignment, args.users, args.assignments)
+            print(f"Seeded in {time.perf_counter() - t0:.1f}s")
+
+    results = bench_web(app, args.iterations, args.admin_iterations)
+    results.extend(asyncio.run(bench_bot(app, args.conversations)))
+    print_report(results)
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux
+        print(f"\nMax RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'users': args.users, 'assignments': args.assignments, 'results': results},
+                      f, ensure_ascii=False, indent=2)
+
+    # A broken flow can look like a speed-up, so errors fail the run outright
+    problems = failures(results)
+    for problem in problems:
+        print(f"FAILED {problem}")
+
+    regressions = compare(results, args.baseline, args.tolerance) if args.baseline else []
+    for name, old, new in regressions:
+        print(f"REGRESSION {name}: p90 {old:.2f} ms -> {new:.2f} ms")
+    if problems or regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
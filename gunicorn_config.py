@@ -1,6 +1,19 @@
+import os
+import tempfile
+
 workers = 4
 worker_class = "sync"
 bind = "0.0.0.0:10000"
 timeout = 120
 keepalive = 5
 worker_connections = 1000
+
+# Load with "gunicorn -c gunicorn_config.py"; gunicorn only picks up gunicorn.conf.py by itself.
+# Only read when passed as "gunicorn -c gunicorn_config.py" (see render.yaml);
+# gunicorn loads gunicorn.conf.py by itself, not this file.
+# Workers share metrics through snapshot files, see metrics.py
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'zakaz-metrics'))
+
+def on_starting(server):
+    import metrics
+    metrics.clear_dir()
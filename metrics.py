@@ -0,0 +1,404 @@
+import os
+import io
+import json
+import hmac
+import glob
+import time
+import uuid
+import random
+import logging
+import cProfile
+import pstats
+import threading
+import functools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from flask import g, request, has_request_context, Response, abort
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# With several Gunicorn workers behind one port, set METRICS_DIR: every process
+# then writes its values to a snapshot file there (at most once per
+# FLUSH_INTERVAL seconds) and /metrics serves the sum over all files. Without
+# it, each process only reports its own numbers.
+METRICS_DIR = os.getenv('METRICS_DIR')
+FLUSH_INTERVAL = 1.0
+# /metrics on the web app answers only requests with "Authorization: Bearer <METRICS_TOKEN>"
+# and is disabled when no token is configured
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+# Address for the bot's standalone metrics server
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250)
+
+# Profile this fraction of web requests and log the ones slower than PROFILE_SLOW_MS
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_SLOW_MS = float(os.getenv('PROFILE_SLOW_MS', '500'))
+
+_registry = []
+_snapshot_path = None
+_last_flush = 0.0
+_flush_lock = threading.Lock()
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels):
+        # Strings only, so keys read back from snapshot files compare equal
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), self._copy_value(value)] for key, value in self._values.items()]
+
+    def _copy_value(self, value):
+        return value
+
+    def merge(self, values, key, value):
+        """Add a value read from another process into values."""
+        values[key] = values.get(key, 0) + value
+
+    def render(self, values=None):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        if values is None:
+            with self._lock:
+                values = dict(self._values)
+        for key, value in values.items():
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {value}']
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, function):
+        """Compute the value at scrape time instead of storing it."""
+        self._function = function
+
+    def refresh(self):
+        if self._function is not None:
+            self.set(self._function())
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _copy_value(self, value):
+        return [list(value[0]), value[1], value[2]]
+
+    def merge(self, values, key, value):
+        entry = values.get(key)
+        if entry is None:
+            values[key] = self._copy_value(value)
+            return
+        entry[0] = [a + b for a, b in zip(entry[0], value[0])]
+        entry[1] += value[1]
+        entry[2] += value[2]
+
+    def _render_value(self, key, value):
+        counts, total, count = value
+        lines = []
+        for bound, bucket_count in zip(self.buckets, counts):
+            labels = _format_labels(self.labelnames, key, [('le', bound)])
+            lines.append(f'{self.name}_bucket{labels} {bucket_count}')
+        labels = _format_labels(self.labelnames, key, [('le', '+Inf')])
+        lines.append(f'{self.name}_bucket{labels} {count}')
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f'{self.name}_sum{labels} {total}')
+        lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+def _snapshot_file():
+    global _snapshot_path
+    # Workers are forked, so the name is picked per process on first use
+    if _snapshot_path is None or _snapshot_path[0] != os.getpid():
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        name = f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json'
+        _snapshot_path = (os.getpid(), os.path.join(METRICS_DIR, name))
+    return _snapshot_path[1]
+
+def _reset_after_fork():
+    # A forked worker starts empty, otherwise the parent's values would be counted twice
+    global _snapshot_path
+    _snapshot_path = None
+    for metric in _registry:
+        metric._values = {}
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def flush(force=False):
+    """Write this process's values to its snapshot file in METRICS_DIR."""
+    global _last_flush
+    if not METRICS_DIR:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush < FLUSH_INTERVAL:
+        return
+    with _flush_lock:
+        _last_flush = now
+        data = {metric.name: metric.snapshot() for metric in _registry}
+        path = _snapshot_file()
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+
+def clear_dir():
+    """Remove snapshots of a previous run; call from the Gunicorn master before forking."""
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    for path in glob.glob(os.path.join(METRICS_DIR, '*.json')):
+        os.remove(path)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def render():
+    """Return all metrics in the Prometheus text exposition format.
+
+    With METRICS_DIR set, counters and histograms are summed over the
+    snapshots of all processes, including exited workers. Gauges describe the
+    present, so they are summed over running processes only.
+    """
+    for metric in _registry:
+        if isinstance(metric, Gauge):
+            metric.refresh()
+    lines = []
+    if not METRICS_DIR:
+        for metric in _registry:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    flush(force=True)
+    merged = {metric.name: {} for metric in _registry}
+    for path in glob.glob(os.path.join(METRICS_DIR, '*.json')):
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        pid = os.path.basename(path).split('-', 1)[0]
+        alive = pid.isdigit() and _pid_alive(int(pid))
+        for metric in _registry:
+            if isinstance(metric, Gauge) and not alive:
+                continue
+            for key, value in data.get(metric.name, []):
+                metric.merge(merged[metric.name], tuple(key), value)
+    for metric in _registry:
+        lines.extend(metric.render(merged[metric.name]))
+    return '\n'.join(lines) + '\n'
+
+# Web
+http_request_seconds = Histogram(
+    'http_request_seconds', 'Web request latency', ('method', 'route', 'status')
+)
+http_request_queries = Histogram(
+    'http_request_sql_queries', 'SQL queries issued per web request', ('route',), COUNT_BUCKETS
+)
+
+# Database
+sql_query_seconds = Histogram('sql_query_seconds', 'SQL statement execution time', ('statement',))
+db_write_lock_seconds = Histogram(
+    'db_write_lock_seconds',
+    'First write statement of each transaction, where SQLite takes the write lock (includes busy waits)'
+)
+db_commit_seconds = Histogram('db_commit_seconds', 'Session commit time (flush and COMMIT)')
+db_lock_errors = Counter('db_lock_errors_total', 'Statements that failed with "database is locked"')
+
+# Bot
+bot_handler_seconds = Histogram('bot_handler_seconds', 'Bot handler latency', ('handler',))
+bot_handler_errors = Counter('bot_handler_errors_total', 'Bot handlers that raised', ('handler',))
+bot_update_queue_depth = Gauge('bot_update_queue_depth', 'Updates waiting to be processed by the bot')
+
+WRITE_STATEMENTS = {'INSERT', 'UPDATE', 'DELETE', 'REPLACE'}
+
+def _route():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    kind = statement.split(None, 1)[0].upper()
+    sql_query_seconds.observe(elapsed, statement=kind)
+    if kind in WRITE_STATEMENTS and not conn.info.get('write_locked'):
+        conn.info['write_locked'] = True
+        db_write_lock_seconds.observe(elapsed)
+    if has_request_context():
+        g.metrics_queries = g.get('metrics_queries', 0) + 1
+
+@event.listens_for(Engine, 'commit')
+@event.listens_for(Engine, 'rollback')
+def _end_transaction(conn):
+    conn.info.pop('write_locked', None)
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(context):
+    conn = context.connection
+    if conn is not None and conn.info.get('query_start'):
+        conn.info['query_start'].pop()
+    if 'database is locked' in str(context.original_exception):
+        db_lock_errors.inc()
+
+@event.listens_for(Session, 'before_commit')
+def _before_commit(session):
+    session.info['commit_start'] = time.perf_counter()
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    start = session.info.pop('commit_start', None)
+    if start is not None:
+        db_commit_seconds.observe(time.perf_counter() - start)
+
+def init_app(app):
+    """Time every request, optionally profile a sample, and expose /metrics."""
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+        if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            g.metrics_profiler = cProfile.Profile()
+            g.metrics_profiler.enable()
+
+    @app.after_request
+    def record_request(response):
+        if 'metrics_start' not in g:
+            return response
+        elapsed = time.perf_counter() - g.metrics_start
+        route = _route()
+        http_request_seconds.observe(
+            elapsed, method=request.method, route=route, status=response.status_code
+        )
+        http_request_queries.observe(g.metrics_queries, route=route)
+
+        profiler = g.pop('metrics_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            if elapsed * 1000 >= PROFILE_SLOW_MS:
+                out = io.StringIO()
+                pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(20)
+                logger.warning(
+                    "Slow request %s %s took %.0f ms\n%s",
+                    request.method, request.path, elapsed * 1000, out.getvalue()
+                )
+        flush()
+        return response
+
+    @app.teardown_request
+    def stop_profiler(error=None):
+        profiler = g.pop('metrics_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+
+    @app.route('/metrics')
+    def metrics():
+        if not METRICS_TOKEN:
+            abort(404)
+        supplied = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(supplied.encode(), f'Bearer {METRICS_TOKEN}'.encode()):
+            abort(401)
+        return Response(render(), mimetype='text/plain; version=0.0.4')
+
+def timed_handler(func):
+    """Record latency and errors of an async bot handler."""
+    @functools.wraps(func)
+    async def wrapper(update, context):
+        start = time.perf_counter()
+        try:
+            return await func(update, context)
+        except Exception:
+            bot_handler_errors.inc(handler=func.__name__)
+            raise
+        finally:
+            bot_handler_seconds.observe(time.perf_counter() - start, handler=func.__name__)
+            flush()
+    return wrapper
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(port, host=METRICS_HOST):
+    """Expose /metrics from a background thread, for processes without Flask (the bot).
+
+    Binds to localhost by default so the endpoint is not public.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
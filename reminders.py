@@ -0,0 +1,222 @@
+import os
+import heapq
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from telegram.error import TelegramError
+from telegram.helpers import escape_markdown
+from app import app, db, User, Assignment, SentReminder
+
+logger = logging.getLogger(__name__)
+
+# Hours before the deadline at which reminders are sent, e.g. "72,24,1"
+REMINDER_OFFSETS = [
+    int(hours) for hours in os.getenv('REMINDER_OFFSETS', '72,24,1').split(',') if hours.strip()
+]
+# How often to look for assignments created outside the bot (e.g. via the web form)
+RESYNC_INTERVAL = timedelta(minutes=int(os.getenv('REMINDER_RESYNC_MINUTES', '10')))
+# Only reminders due this soon are kept in memory; each resync queues the next
+# ones. Twice the interval so a slow resync does not leave a gap.
+RESYNC_HORIZON = 2 * RESYNC_INTERVAL
+
+# Assignments are read in id-ordered batches, which also keeps the sent
+# reminder lookup below SQLite's bound-parameter limit
+LOAD_BATCH_SIZE = 500
+
+# The bot stores deadlines as ДД.ММ.ГГГГ, the web form as ГГГГ-ММ-ДД
+DEADLINE_FORMATS = ["%d.%m.%Y", "%Y-%m-%d"]
+
+def parse_deadline(value):
+    """Parse a stored deadline string, returning None if it is not a known format.
+
+    Deadlines are dates, so the work is due by the end of that day: the
+    returned moment is midnight at the start of the following day.
+    """
+    for fmt in DEADLINE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt) + timedelta(days=1)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+def format_remaining(delta):
+    """Describe the time left until the deadline, e.g. "2 дн. 5 ч." or "40 мин."."""
+    minutes = max(int(delta.total_seconds() // 60), 0)
+    days, minutes = divmod(minutes, 24 * 60)
+    hours, minutes = divmod(minutes, 60)
+    if days:
+        return f"{days} дн. {hours} ч."
+    if hours:
+        return f"{hours} ч. {minutes} мин."
+    return f"{minutes} мин."
+
+class DeadlineScheduler:
+    """Keeps a heap of upcoming reminders and sleeps until the earliest one is due."""
+
+    def __init__(self, bot, offsets=None):
+        self.bot = bot
+        self.offsets = sorted(offsets or REMINDER_OFFSETS, reverse=True)
+        self._queue = []  # (due_at, assignment_id, offset_hours)
+        self._scheduled = set()  # (assignment_id, offset_hours) currently in the heap
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def add(self, assignment):
+        """Queue reminders for a freshly created assignment and wake the loop."""
+        assignment_id, deadline = assignment.id, assignment.deadline
+        now = datetime.now()
+        with app.app_context():
+            sent = self._sent_offsets([assignment_id])
+        self._push(self._due_reminders(assignment_id, deadline, sent, now, now + RESYNC_HORIZON))
+        self._wakeup.set()
+
+    def _sent_offsets(self, assignment_ids):
+        sent = set()
+        rows = SentReminder.query.filter(SentReminder.assignment_id.in_(assignment_ids)).all()
+        for row in rows:
+            sent.add((row.assignment_id, row.offset_hours))
+        return sent
+
+    def _due_reminders(self, assignment_id, deadline_text, sent, now, horizon):
+        """Return (due_at, assignment_id, offset) for reminders due before horizon."""
+        deadline = parse_deadline(deadline_text)
+        if deadline is None:
+            logger.warning("Assignment %s has unparseable deadline %r", assignment_id, deadline_text)
+            return []
+        if deadline <= now:
+            return []
+        due = []
+        for offset in self.offsets:
+            if (assignment_id, offset) in sent:
+                continue
+            due_at = deadline - timedelta(hours=offset)
+            # Later reminders are picked up by the resync that precedes them
+            if due_at >= horizon:
+                continue
+            # A reminder whose moment already passed is sent right away, so only
+            # the closest overdue offset is kept to avoid a burst of stale messages.
+            if due_at <= now and any(
+                deadline - timedelta(hours=o) <= now for o in self.offsets if o < offset
+            ):
+                continue
+            due.append((due_at, assignment_id, offset))
+        return due
+
+    def _push(self, reminders):
+        for due_at, assignment_id, offset in reminders:
+            key = (assignment_id, offset)
+            if key in self._scheduled:
+                continue
+            heapq.heappush(self._queue, (due_at, assignment_id, offset))
+            self._scheduled.add(key)
+
+    def _load_due(self, now, horizon):
+        """Find reminders of unfinished assignments due before horizon.
+
+        Deadlines are stored as text in two formats, so they are parsed here
+        rather than filtered in SQL. Runs in a worker thread; the caller pushes
+        the result onto the heap.
+        """
+        reminders = []
+        last_id = 0
+        with app.app_context():
+            while True:
+                rows = (
+                    db.session.query(Assignment.id, Assignment.deadline)
+                    .filter(Assignment.id > last_id, Assignment.status != 'completed')
+                    .order_by(Assignment.id)
+                    .limit(LOAD_BATCH_SIZE)
+                    .all()
+                )
+                if not rows:
+                    return reminders
+                last_id = rows[-1].id
+                batch = {}
+                for row in rows:
+                    due = self._due_reminders(row.id, row.deadline, set(), now, horizon)
+                    if due:
+                        batch[row.id] = due
+                if not batch:
+                    continue
+                sent = self._sent_offsets(list(batch))
+                for due in batch.values():
+                    reminders.extend(r for r in due if (r[1], r[2]) not in sent)
+
+    async def _run(self):
+        next_resync = datetime.now()
+        while True:
+            now = datetime.now()
+            if now >= next_resync:
+                try:
+                    # Off the event loop: this reads every unfinished assignment
+                    self._push(await asyncio.to_thread(self._load_due, now, now + RESYNC_HORIZON))
+                except Exception:
+                    logger.exception("Failed to load assignments for reminders")
+                next_resync = now + RESYNC_INTERVAL
+
+            while self._queue and self._queue[0][0] <= datetime.now():
+                due_at, assignment_id, offset = heapq.heappop(self._queue)
+                self._scheduled.discard((assignment_id, offset))
+                try:
+                    await self._send(assignment_id, offset)
+                except Exception:
+                    logger.exception("Failed to send reminder for assignment %s", assignment_id)
+
+            wake_at = next_resync
+            if self._queue:
+                wake_at = min(wake_at, self._queue[0][0])
+            delay = max((wake_at - datetime.now()).total_seconds(), 0)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _send(self, assignment_id, offset):
+        with app.app_context():
+            assignment = Assignment.query.get(assignment_id)
+            if assignment is None or assignment.status == 'completed':
+                return
+            # Claim the reminder first: the unique constraint makes a restart or a
+            # second scheduler skip it instead of sending a duplicate.
+            db.session.add(SentReminder(assignment_id=assignment_id, offset_hours=offset))
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                return
+
+            recipients = [a.telegram_id for a in User.query.filter(
+                User.is_admin.is_(True), User.telegram_id.isnot(None)
+            ).all()]
+            if assignment.student.telegram_id:
+                recipients.append(assignment.student.telegram_id)
+
+            # Overdue offsets are sent late, so report the actual time left
+            remaining = parse_deadline(assignment.deadline) - datetime.now()
+            text = (
+                f"⏰ Напоминание: до срока сдачи осталось {format_remaining(remaining)}\n\n"
+                f"*Предмет(ы):* {escape_markdown(assignment.subjects)}\n"
+                f"*Тип работы:* {escape_markdown(assignment.work_type)}\n"
+                f"*Срок сдачи:* {escape_markdown(assignment.deadline)}"
+            )
+
+        for chat_id in dict.fromkeys(recipients):
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, parse_mode='Markdown')
+            except TelegramError as error:
+                # e.g. the user blocked the bot; the others should still be reminded
+                logger.warning("Could not send reminder for assignment %s to %s: %s", assignment_id, chat_id, error)
@@ -0,0 +1,272 @@
+"""Replay a JSONL log of web requests and bot updates against local stand-ins.
+
+Each line is one event with a timestamp (epoch seconds or ISO 8601) and a type:
+
+    {"ts": 1729240000.0, "type": "http", "client": "s1", "method": "POST",
+     "path": "/login", "form": {"username": "student0", "password": "..."},
+     "remote_addr": "10.0.0.7"}
+    {"ts": 1729240000.4, "type": "http", "client": "s1", "method": "POST",
+     "path": "/assignment/new", "form": {...},
+     "files": {"attachment": {"filename": "task.pdf", "size": 20480}}}
+    {"ts": "2024-10-18T10:00:01", "type": "bot", "update": {<raw Telegram update>}}
+
+HTTP events go through the Flask test client, one cookie jar per "client";
+bot updates go through the real ConversationHandler with the Bot API
+answered by telegram_stub. Events are dispatched at their recorded times
+without waiting for earlier ones to finish. Lines without a known type are
+counted as skipped.
+
+An HTTP event counts as an error when it gets a 4xx/5xx response, when a
+login is rejected, or when it is redirected to /login. A bot update counts as
+an error when one of its handlers raised. The report also breaks responses
+down by status code.
+
+Usage:
+    python replay.py traffic.jsonl               # real time
+    python replay.py traffic.jsonl --speed 10    # 10x faster
+    python replay.py traffic.jsonl --speed 0     # as fast as possible
+"""
+import os
+import io
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from collections import defaultdict, Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from benchmark import percentile
+
+def parse_ts(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value).timestamp()
+
+def load_events(path):
+    """Read the log, returning (events sorted by time, number of skipped lines)."""
+    events = []
+    skipped = 0
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                event = json.loads(line)
+                if event.get('type') not in ('http', 'bot'):
+                    raise ValueError(event.get('type'))
+                event['ts'] = parse_ts(event['ts'])
+            except (ValueError, KeyError, TypeError, AttributeError):
+                skipped += 1
+                continue
+            events.append(event)
+    events.sort(key=lambda e: e['ts'])
+    return events, skipped
+
+def bot_label(update):
+    if update.get('callback_query'):
+        return 'bot: callback_query'
+    message = update.get('message') or {}
+    if message.get('document'):
+        return 'bot: document'
+    text = message.get('text') or ''
+    if text.startswith('/'):
+        return f"bot: {text.split()[0]}"
+    return 'bot: text'
+
+def http_request(clients, app, event):
+    client = clients.get(event.get('client', 'default'))
+    if client is None:
+        client = clients[event.get('client', 'default')] = app.test_client()
+    data = dict(event.get('form') or {})
+    for field, spec in (event.get('files') or {}).items():
+        data[field] = (io.BytesIO(b'\0' * spec.get('size', 0)), spec.get('filename', 'file'))
+    environ = {'REMOTE_ADDR': event['remote_addr']} if event.get('remote_addr') else None
+    return client.open(
+        event['path'],
+        method=event.get('method', 'GET'),
+        query_string=event.get('query'),
+        data=data or None,
+        content_type='multipart/form-data' if event.get('files') else None,
+        environ_base=environ,
+    )
+
+def http_failed(event, response):
+    """Whether a response means the recorded request did not do its job."""
+    if response.status_code >= 400:
+        return True
+    path = event['path'].split('?', 1)[0]
+    # A rejected login re-renders the form instead of redirecting
+    if path == '/login' and event.get('method', 'GET') == 'POST':
+        return response.status_code != 302
+    # login_required bounced the request to the login page
+    location = response.headers.get('Location', '')
+    return response.status_code == 302 and '/login' in location and path != '/logout'
+
+async def replay(events, app, speed, bot_latency, workers):
+    """Dispatch events at their recorded times without waiting for earlier ones.
+
+    HTTP requests run on a thread pool and bot updates as tasks, so overlapping
+    traffic overlaps here too. Requests of one recorded client and updates of
+    one chat stay in order, as a browser session or a conversation would.
+    """
+    from telegram import Update
+    from telegram_stub import StubRequest, build_stub_application
+
+    request = StubRequest(latency=bot_latency)
+    application = await build_stub_application(request)
+    failed_updates = set()
+
+    async def count_error(update, context):
+        if isinstance(update, Update):
+            failed_updates.add(update.update_id)
+    application.add_error_handler(count_error)
+
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    clients = {}
+    locks = defaultdict(asyncio.Lock)
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    statuses = defaultdict(Counter)
+
+    def record(label, t0, status, failed):
+        latencies[label].append(time.perf_counter() - t0)
+        statuses[label][status] += 1
+        if failed:
+            errors[label] += 1
+
+    async def run_http(event):
+        label = f"{event.get('method', 'GET')} {event['path'].split('?', 1)[0]}"
+        client_id = event.get('client', 'default')
+        async with locks[('http', client_id)]:
+            t0 = time.perf_counter()
+            try:
+                response = await loop.run_in_executor(executor, http_request, clients, app, event)
+            except Exception as error:
+                record(label, t0, type(error).__name__, True)
+                return
+            record(label, t0, response.status_code, http_failed(event, response))
+
+    async def run_bot(event):
+        label = bot_label(event['update'])
+        update = Update.de_json(event['update'], application.bot)
+        chat = update.effective_chat.id if update.effective_chat else None
+        async with locks[('bot', chat)]:
+            t0 = time.perf_counter()
+            try:
+                await application.process_update(update)
+            except Exception as error:
+                record(label, t0, type(error).__name__, True)
+                return
+            failed = update.update_id in failed_updates
+            record(label, t0, 'error' if failed else 'ok', failed)
+
+    tasks = []
+    max_lag = 0.0
+    first_ts = events[0]['ts'] if events else 0.0
+    started = time.perf_counter()
+    for event in events:
+        if speed:
+            due = (event['ts'] - first_ts) / speed
+            delay = due - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+        runner = run_http if event['type'] == 'http' else run_bot
+        tasks.append(asyncio.create_task(runner(event)))
+    await asyncio.gather(*tasks)
+
+    elapsed = time.perf_counter() - started
+    executor.shutdown()
+    await application.shutdown()
+    return latencies, errors, statuses, elapsed, max_lag, dict(request.calls)
+
+def build_report(latencies, errors, statuses, elapsed, max_lag, bot_calls, skipped):
+    rows = []
+    for label in sorted(latencies):
+        values = latencies[label]
+        rows.append({
+            'name': label,
+            'count': len(values),
+            'errors': errors.get(label, 0),
+            'p50_ms': percentile(values, 50) * 1000,
+            'p90_ms': percentile(values, 90) * 1000,
+            'p99_ms': percentile(values, 99) * 1000,
+            'max_ms': max(values) * 1000,
+            'statuses': {str(status): n for status, n in sorted(statuses[label].items(), key=str)},
+        })
+    return {
+        'events': sum(r['count'] for r in rows),
+        'errors': sum(r['errors'] for r in rows),
+        'skipped': skipped,
+        'elapsed_s': elapsed,
+        'max_lag_ms': max_lag * 1000,
+        'bot_api_calls': bot_calls,
+        'results': rows,
+    }
+
+def print_report(report):
+    header = f"{'event':<32}{'count':>7}{'err':>6}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}  statuses"
+    print(header)
+    print('-' * len(header))
+    for r in report['results']:
+        statuses = ' '.join(f"{status}:{n}" for status, n in r['statuses'].items())
+        print(f"{r['name']:<32}{r['count']:>7}{r['errors']:>6}"
+              f"{r['p50_ms']:>10.2f}{r['p90_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['max_ms']:>10.2f}  {statuses}")
+    print(f"\n{report['events']} events in {report['elapsed_s']:.1f}s, {report['errors']} errors, "
+          f"{report['skipped']} skipped lines, max schedule lag {report['max_lag_ms']:.0f} ms")
+    print(f"Bot API calls: {report['bot_api_calls']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('log', help='JSONL file with recorded events')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed-up, 0 for no pauses')
+    parser.add_argument('--db', help='SQLite file to replay against (default: an empty temporary one)')
+    parser.add_argument('--bot-latency', type=float, default=0.0, help='simulated Bot API latency in seconds')
+    parser.add_argument('--workers', type=int, default=8, help='threads for concurrent HTTP requests')
+    parser.add_argument('--no-rate-limit', action='store_true', help='disable the login rate limiter')
+    parser.add_argument('--json', help='write the report to this file')
+    args = parser.parse_args()
+
+    events, skipped = load_events(args.log)
+
+    workdir = tempfile.mkdtemp(prefix='zakaz-replay-')
+    db_path = os.path.abspath(args.db or os.path.join(workdir, 'replay.db'))
+    # app reads these at import time, so they must be set before importing it
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    os.environ['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+    if args.no_rate_limit:
+        os.environ['LOGIN_RATE_PER_MINUTE'] = '0'
+
+    import logging
+    from app import app, User
+    logging.getLogger().setLevel(logging.WARNING)
+
+    http_events = [e for e in events if e['type'] == 'http']
+    with app.app_context():
+        only_admin = User.query.count() <= 1
+    if http_events and only_admin:
+        print("!" * 72, file=sys.stderr)
+        print(f"WARNING: replaying against an empty database ({db_path}).", file=sys.stderr)
+        print("Recorded logins will fail and most requests will be redirected to /login.", file=sys.stderr)
+        print("Pass --db with a copy of a populated database for meaningful results.", file=sys.stderr)
+        print("!" * 72, file=sys.stderr)
+    if not args.no_rate_limit and any(not e.get('remote_addr') for e in http_events):
+        print("WARNING: events without remote_addr share one address and the login rate "
+              "limiter applies to all of them; expect 429s or use --no-rate-limit.", file=sys.stderr)
+
+    report = build_report(
+        *asyncio.run(replay(events, app, args.speed, args.bot_latency, args.workers)), skipped
+    )
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
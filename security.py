@@ -0,0 +1,74 @@
+import os
+import hmac
+import time
+import threading
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# PBKDF2 work factor. Raising it makes existing hashes get upgraded on the next login.
+PASSWORD_HASH_ITERATIONS = int(os.getenv('PASSWORD_HASH_ITERATIONS', '260000'))
+PASSWORD_HASH_METHOD = f'pbkdf2:sha256:{PASSWORD_HASH_ITERATIONS}'
+
+# Stored for accounts that must not log in with a password (e.g. bot users)
+UNUSABLE_PASSWORD = '!'
+
+# Login attempts allowed per minute for each client IP and each username; 0 disables the limit
+LOGIN_RATE_PER_MINUTE = float(os.getenv('LOGIN_RATE_PER_MINUTE', '10'))
+LOGIN_BURST = int(os.getenv('LOGIN_BURST', '5'))
+
+def hash_password(password):
+    return generate_password_hash(password, method=PASSWORD_HASH_METHOD)
+
+# Checked when there is no real hash (unknown username, bot account), so a
+# failed login costs the same either way and timing does not reveal which
+# usernames exist
+DUMMY_PASSWORD_HASH = hash_password(os.urandom(16).hex())
+
+def verify_password(stored, password):
+    """Check a password against the stored value.
+
+    Returns (matches, needs_rehash). Plaintext values left from before hashing
+    and hashes with a different work factor match but need a rehash.
+    """
+    if not password:
+        return False, False
+    if not stored or stored == UNUSABLE_PASSWORD:
+        # Same cost as a real check, so accounts without a password do not stand out
+        check_password_hash(DUMMY_PASSWORD_HASH, password)
+        return False, False
+    if stored.startswith('pbkdf2:'):
+        matches = check_password_hash(stored, password)
+        return matches, matches and stored.split('$', 1)[0] != PASSWORD_HASH_METHOD
+    matches = hmac.compare_digest(stored.encode(), password.encode())
+    return matches, matches
+
+class RateLimiter:
+    """Token buckets keyed by an arbitrary string, refilled continuously."""
+
+    def __init__(self, rate_per_minute, burst, max_keys=10000):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = {}  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        """Take a token for key, returning False when its bucket is empty."""
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            allowed = tokens >= 1
+            self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+        return allowed
+
+    def _prune(self, now):
+        # Buckets that have refilled completely carry no state worth keeping
+        for key, (tokens, updated_at) in list(self._buckets.items()):
+            if tokens + (now - updated_at) * self.rate >= self.burst:
+                del self._buckets[key]
+
+login_limiter = RateLimiter(LOGIN_RATE_PER_MINUTE, LOGIN_BURST)
@@ -0,0 +1,78 @@
+import os
+import hashlib
+import tempfile
+
+# Content-addressed storage for task attachments: files live under
+# UPLOAD_FOLDER/ab/cd/<sha256>, so identical uploads share a single copy.
+UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads'))
+MAX_UPLOAD_SIZE = int(os.getenv('MAX_UPLOAD_SIZE', str(20 * 1024 * 1024)))
+CHUNK_SIZE = 64 * 1024
+
+class FileTooLarge(Exception):
+    pass
+
+def path_for(digest):
+    """Return the storage path for a SHA-256 hex digest."""
+    return os.path.join(UPLOAD_FOLDER, digest[:2], digest[2:4], digest)
+
+def temp_path():
+    """Return a fresh temporary path on the same filesystem as the storage."""
+    tmp_dir = os.path.join(UPLOAD_FOLDER, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=tmp_dir)
+    os.close(fd)
+    return path
+
+def _commit(tmp, digest):
+    target = path_for(digest)
+    if os.path.exists(target):
+        # Duplicate upload: the content is already stored
+        os.remove(tmp)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(tmp, target)
+    return target
+
+def save_stream(stream, max_size=MAX_UPLOAD_SIZE):
+    """Copy a file-like object into storage chunk by chunk.
+
+    Returns (sha256 hex digest, size in bytes). Raises FileTooLarge once more
+    than max_size bytes have been read.
+    """
+    tmp = temp_path()
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise FileTooLarge(size)
+                sha256.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    digest = sha256.hexdigest()
+    _commit(tmp, digest)
+    return digest, size
+
+def save_file(tmp, max_size=MAX_UPLOAD_SIZE):
+    """Move an already downloaded file from temp_path() into storage.
+
+    Returns (sha256 hex digest, size in bytes).
+    """
+    size = os.path.getsize(tmp)
+    if size > max_size:
+        os.remove(tmp)
+        raise FileTooLarge(size)
+    sha256 = hashlib.sha256()
+    with open(tmp, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    digest = sha256.hexdigest()
+    _commit(tmp, digest)
+    return digest, size
@@ -1,12 +1,20 @@
 import os
+import uuid
+import asyncio
 import logging
 from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TelegramError
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, CallbackQueryHandler,
     filters, ContextTypes, ConversationHandler
 )
-from app import app, db, User, Assignment
+from sqlalchemy.exc import IntegrityError
+from app import app, db, User, Assignment, Attachment
+from security import UNUSABLE_PASSWORD
+import storage
+import metrics
+from reminders import DeadlineScheduler
 from dotenv import load_dotenv
 
 # Enable logging
@@ -20,7 +28,7 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 # Define conversation states
-COURSE, SEMESTER, FACULTY, SUBJECTS, DEADLINE, TASK_SOURCE, WORK_TYPE = range(7)
+COURSE, SEMESTER, FACULTY, SUBJECTS, DEADLINE, TASK_SOURCE, WORK_TYPE, ATTACHMENT = range(8)
 
 # Mock data (replace with your actual data)
 FACULTIES = ["Факультет 1", "Факультет 2", "Факультет 3"]
@@ -39,8 +47,11 @@ def create_keyboard(options, columns=2):
     return InlineKeyboardMarkup(keyboard)
 
 # Command handlers
+@metrics.timed_handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Start the conversation and ask for course."""
+    context.user_data.clear()
+    context.user_data['order_key'] = uuid.uuid4().hex
     await update.message.reply_text(
         "👋 Добро пожаловать в бота для заказа учебных работ!\n\n"
         "📚 Пожалуйста, выберите ваш курс:",
@@ -48,6 +59,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     )
     return COURSE
 
+@metrics.timed_handler
 async def course_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Store course and ask for semester."""
     query = update.callback_query
@@ -68,6 +80,7 @@ async def course_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     )
     return SEMESTER
 
+@metrics.timed_handler
 async def semester_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Store semester and ask for faculty."""
     query = update.callback_query
@@ -81,6 +94,7 @@ async def semester_selected(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
     return FACULTY
 
+@metrics.timed_handler
 async def faculty_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Store faculty and ask for subjects."""
     query = update.callback_query
@@ -102,7 +116,7 @@ async def faculty_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     )
     
     # Add a "Готово" button
-    keyboard = create_keyboard(subjects, 2).inline_keyboard
+    keyboard = list(create_keyboard(subjects, 2).inline_keyboard)
     keyboard.append([InlineKeyboardButton("✅ Готово", callback_data="done")])
     
     await query.edit_message_text(
@@ -111,6 +125,7 @@ async def faculty_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     )
     return SUBJECTS
 
+@metrics.timed_handler
 async def subjects_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle subject selection and ask for deadline when done."""
     query = update.callback_query
@@ -161,6 +176,7 @@ async def subjects_selected(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
     return SUBJECTS
 
+@metrics.timed_handler
 async def deadline_received(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Store deadline and ask for task source."""
     user_id = update.message.from_user.id
@@ -195,6 +211,7 @@ async def deadline_received(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         return DEADLINE
 
+@metrics.timed_handler
 async def task_source_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Store task source and ask for work type."""
     query = update.callback_query
@@ -203,6 +220,13 @@ async def task_source_selected(update: Update, context: ContextTypes.DEFAULT_TYP
     task_source = query.data
     context.user_data['task_source'] = "загрузка файла" if task_source == "upload" else "вход в Moodle"
     
+    if task_source == "upload":
+        await query.edit_message_text(
+            "📤 Отправьте файл с заданием одним документом "
+            f"(не более {storage.MAX_UPLOAD_SIZE // (1024 * 1024)} МБ):"
+        )
+        return ATTACHMENT
+    
     # Ask for work type
     await query.edit_message_text(
         "📝 Выберите тип работы:",
@@ -210,6 +234,63 @@ async def task_source_selected(update: Update, context: ContextTypes.DEFAULT_TYP
     )
     return WORK_TYPE
 
+@metrics.timed_handler
+async def attachment_received(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Store the task file and ask for work type."""
+    document = update.message.document
+    
+    if document.file_size and document.file_size > storage.MAX_UPLOAD_SIZE:
+        await update.message.reply_text(
+            "❌ Файл слишком большой. Пожалуйста, отправьте файл меньшего размера:"
+        )
+        return ATTACHMENT
+    
+    # Download straight to disk so the file never sits in memory
+    tmp = storage.temp_path()
+    try:
+        tg_file = await document.get_file()
+        await tg_file.download_to_drive(custom_path=tmp)
+        # Hashing a large file would otherwise block the event loop
+        digest, size = await asyncio.to_thread(storage.save_file, tmp)
+    except storage.FileTooLarge:
+        await update.message.reply_text(
+            "❌ Файл слишком большой. Пожалуйста, отправьте файл меньшего размера:"
+        )
+        return ATTACHMENT
+    except TelegramError:
+        logger.exception("Failed to download attachment")
+        await update.message.reply_text(
+            "❌ Не удалось загрузить файл. Пожалуйста, отправьте его ещё раз:"
+        )
+        return ATTACHMENT
+    finally:
+        # save_file moves the file into storage; anything left over is a failed download
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    
+    context.user_data['attachment'] = {
+        'sha256': digest,
+        'size': size,
+        'filename': document.file_name or digest,
+        'content_type': document.mime_type,
+    }
+    
+    await update.message.reply_text(
+        "📝 Файл получен! Выберите тип работы:",
+        reply_markup=create_keyboard(WORK_TYPES, 1)
+    )
+    return WORK_TYPE
+
+@metrics.timed_handler
+async def attachment_expected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Remind the user that the task has to be sent as a document."""
+    await update.message.reply_text(
+        "📎 Пожалуйста, отправьте задание файлом (документом). "
+        "Фото и текст не принимаются. Для отмены нажмите /cancel."
+    )
+    return ATTACHMENT
+
+@metrics.timed_handler
 async def work_type_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Store work type and show summary."""
     query = update.callback_query
@@ -238,27 +319,41 @@ async def work_type_selected(update: Update, context: ContextTypes.DEFAULT_TYPE)
         if not user:
             user = User(
                 username=f"tg_{query.from_user.id}",
-                password="telegram_user",  # In production, generate a secure password
+                password=UNUSABLE_PASSWORD,
                 telegram_id=str(query.from_user.id)
             )
             db.session.add(user)
             db.session.commit()
         
-        # Create assignment
-        assignment = Assignment(
-            course=user_data.get('course', ''),
-            semester=user_data.get('semester', ''),
-            faculty=user_data.get('faculty', ''),
-            subjects=", ".join(user_data.get('subjects', [])),
-            deadline=user_data.get('deadline', ''),
-            task_source=user_data.get('task_source', ''),
-            work_type=work_type,
-            user_id=user.id,
-            status='pending',
-            created_at=datetime.utcnow()
-        )
-        db.session.add(assignment)
-        db.session.commit()
+        # The key is fixed for the whole conversation, so a repeated tap (e.g. after
+        # the summary edit below failed) finds the saved order instead of adding another
+        order_key = user_data.setdefault('order_key', uuid.uuid4().hex)
+        if not Assignment.query.filter_by(user_id=user.id, idempotency_key=order_key).first():
+            # Create assignment
+            assignment = Assignment(
+                course=user_data.get('course', ''),
+                semester=user_data.get('semester', ''),
+                faculty=user_data.get('faculty', ''),
+                subjects=", ".join(user_data.get('subjects', [])),
+                deadline=user_data.get('deadline', ''),
+                task_source=user_data.get('task_source', ''),
+                work_type=work_type,
+                user_id=user.id,
+                status='pending',
+                created_at=datetime.utcnow(),
+                idempotency_key=order_key
+            )
+            db.session.add(assignment)
+            if user_data.get('attachment'):
+                db.session.add(Attachment(assignment=assignment, **user_data['attachment']))
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+            else:
+                scheduler = context.application.bot_data.get('reminders')
+                if scheduler:
+                    scheduler.add(assignment)
     
     await query.edit_message_text(
         summary,
@@ -269,6 +364,7 @@ async def work_type_selected(update: Update, context: ContextTypes.DEFAULT_TYPE)
     context.user_data.clear()
     return ConversationHandler.END
 
+@metrics.timed_handler
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Cancel and end the conversation."""
     context.user_data.clear()
@@ -278,11 +374,20 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     )
     return ConversationHandler.END
 
-def main() -> None:
-    """Run the bot."""
-    # Create the Application
-    application = Application.builder().token(os.getenv('BOT_TOKEN')).build()
+async def start_reminders(application: Application) -> None:
+    """Start the deadline reminder scheduler in the bot's event loop."""
+    scheduler = DeadlineScheduler(application.bot)
+    application.bot_data['reminders'] = scheduler
+    scheduler.start()
+
+async def stop_reminders(application: Application) -> None:
+    """Stop the deadline reminder scheduler."""
+    scheduler = application.bot_data.pop('reminders', None)
+    if scheduler:
+        await scheduler.stop()
 
+def add_handlers(application: Application) -> None:
+    """Register the order conversation on the application."""
     # Add conversation handler with the states
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler('start', start)],
@@ -294,12 +399,33 @@ def main() -> None:
             DEADLINE: [MessageHandler(filters.TEXT & ~filters.COMMAND, deadline_received)],
             TASK_SOURCE: [CallbackQueryHandler(task_source_selected)],
             WORK_TYPE: [CallbackQueryHandler(work_type_selected)],
+            ATTACHMENT: [
+                MessageHandler(filters.Document.ALL, attachment_received),
+                MessageHandler(~filters.COMMAND, attachment_expected),
+            ],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
     )
 
     application.add_handler(conv_handler)
 
+def main() -> None:
+    """Run the bot."""
+    # Create the Application
+    application = (
+        Application.builder()
+        .token(os.getenv('BOT_TOKEN'))
+        .post_init(start_reminders)
+        .post_shutdown(stop_reminders)
+        .build()
+    )
+    add_handlers(application)
+
+    metrics_port = os.getenv('METRICS_PORT')
+    if metrics_port:
+        metrics.bot_update_queue_depth.set_function(application.update_queue.qsize)
+        metrics.serve(int(metrics_port))
+
     # Start the Bot
     print("Starting bot...")
     application.run_polling()
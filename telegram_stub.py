@@ -0,0 +1,163 @@
+import json
+import time
+import asyncio
+from collections import Counter
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest
+from telegram_bot import add_handlers
+
+# Local stand-in for the Telegram Bot API, used by benchmark.py and replay.py
+# to drive the real ConversationHandler without network access.
+
+STUB_TOKEN = '123456:stub'
+BOT_USER = {
+    'id': 123456,
+    'is_bot': True,
+    'first_name': 'Stub',
+    'username': 'stub_bot',
+    'can_join_groups': False,
+    'can_read_all_group_messages': False,
+    'supports_inline_queries': False,
+}
+
+class StubRequest(BaseRequest):
+    """Answers Bot API calls locally and counts them per method."""
+
+    def __init__(self, latency=0.0, file_content=b'%PDF-1.4 stub task file\n'):
+        self.latency = latency
+        self.file_content = file_content
+        self.calls = Counter()
+        self._message_id = 0
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, params):
+        self._message_id += 1
+        chat_id = params.get('chat_id', 0)
+        return {
+            'message_id': params.get('message_id', self._message_id),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if '/file/bot' in url:
+            self.calls['download'] += 1
+            return 200, self.file_content
+
+        api_method = url.rsplit('/', 1)[-1]
+        self.calls[api_method] += 1
+        params = request_data.parameters if request_data else {}
+
+        if api_method == 'getMe':
+            result = BOT_USER
+        elif api_method in ('sendMessage', 'editMessageText'):
+            result = self._message(params)
+        elif api_method == 'getFile':
+            result = {
+                'file_id': params['file_id'],
+                'file_unique_id': f"u{params['file_id']}",
+                'file_size': len(self.file_content),
+                'file_path': f"documents/{params['file_id']}",
+            }
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+async def build_stub_application(request):
+    """Build and initialize an Application with the bot's handlers on top of a StubRequest."""
+    application = (
+        Application.builder()
+        .token(STUB_TOKEN)
+        .request(request)
+        .get_updates_request(request)
+        .updater(None)
+        .build()
+    )
+    add_handlers(application)
+    await application.initialize()
+    return application
+
+class UpdateFactory:
+    """Builds raw Telegram updates for a simulated private chat."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_id = 0
+        self._message_id = 0
+
+    def _next_ids(self):
+        self._update_id += 1
+        self._message_id += 1
+        return self._update_id, self._message_id
+
+    def _message(self, user_id, message_id, **fields):
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'Student {user_id}'},
+        }
+        message.update(fields)
+        return message
+
+    def command(self, user_id, command):
+        update_id, message_id = self._next_ids()
+        text = f'/{command}'
+        return self.from_dict({
+            'update_id': update_id,
+            'message': self._message(
+                user_id, message_id, text=text,
+                entities=[{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+            ),
+        })
+
+    def text(self, user_id, text):
+        update_id, message_id = self._next_ids()
+        return self.from_dict({'update_id': update_id, 'message': self._message(user_id, message_id, text=text)})
+
+    def callback(self, user_id, data):
+        update_id, message_id = self._next_ids()
+        message = self._message(user_id, message_id, text='...')
+        message['from'] = BOT_USER
+        return self.from_dict({
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': {'id': user_id, 'is_bot': False, 'first_name': f'Student {user_id}'},
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': message,
+            },
+        })
+
+    def document(self, user_id, file_name='task.pdf', mime_type='application/pdf', file_size=1024):
+        update_id, message_id = self._next_ids()
+        return self.from_dict({
+            'update_id': update_id,
+            'message': self._message(user_id, message_id, document={
+                'file_id': f'file{update_id}',
+                'file_unique_id': f'ufile{update_id}',
+                'file_name': file_name,
+                'mime_type': mime_type,
+                'file_size': file_size,
+            }),
+        })
+
+    def from_dict(self, data):
+        return Update.de_json(data, self.bot)